@@ -0,0 +1,3 @@
+from keysound.engine import Engine
+
+__all__ = ["Engine"]
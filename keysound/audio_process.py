@@ -0,0 +1,269 @@
+"""
+Out-of-process audio engine.
+
+The decoding and the playback run in a dedicated child process, thus a
+GC pause or a slow callback in the main process (pynput listeners,
+argument handling, etc.) can't glitch the audio.
+
+The main process puts the trigger events in a ring buffer in shared
+memory and writes a byte in the child's stdin (doorbell) to wake it up.
+The child builds its own Sound (mapping the shared bank if enabled),
+so the sound indexes are the same in both processes.
+
+A supervisor thread restarts the child if it dies. The child exits
+when its stdin is closed (i.e. when the main process exits).
+
+Usage (the child): python -m keysound.audio_process <ring name> <config JSON>
+"""
+
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from time import monotonic, perf_counter, sleep
+from typing import Any, Hashable
+
+from keysound.idle import IdleMonitor
+from keysound.sound import Sound
+
+RING_CAPACITY = 256  # number of events
+MAX_DELAY = 0.25  # seconds; older events are dropped (a late click is worse than no click)
+MAX_BACKOFF = 5.0  # seconds between two restarts (at most)
+
+PACKAGE_PARENT = str(Path(__file__).resolve().parent.parent)
+
+
+def untrack(shm: SharedMemory) -> None:
+    # Python's resource tracker would unlink the segment when the child
+    # exits, but it belongs to the main process
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+
+
+class RingBuffer:
+    """
+    Single producer (main process), single consumer (child).
+    The indexes only grow, the slot of index i is i % capacity.
+    """
+
+    HEADER = struct.Struct("QQQ")  # capacity, write index, read index
+    SLOT = struct.Struct("dI4x")  # trigger time (monotonic), sound index
+
+    def __init__(self, shm: SharedMemory) -> None:
+        self.shm = shm
+        self.name = shm.name
+        self.capacity = self.HEADER.unpack_from(shm.buf, 0)[0]
+
+    @classmethod
+    def create(cls, capacity: int = RING_CAPACITY) -> "RingBuffer":
+        size = cls.HEADER.size + capacity * cls.SLOT.size
+        shm = SharedMemory(create=True, size=size)
+        cls.HEADER.pack_into(shm.buf, 0, capacity, 0, 0)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> "RingBuffer":
+        shm = SharedMemory(name=name)
+        untrack(shm)
+        return cls(shm)
+
+    def _indexes(self) -> tuple[int, int]:
+        _, write, read = self.HEADER.unpack_from(self.shm.buf, 0)
+        return write, read
+
+    def push(self, t: float, sound_index: int) -> bool:
+        """
+        Returns False if the buffer is full (the event is dropped).
+        """
+        write, read = self._indexes()
+        if write - read >= self.capacity:
+            return False
+        # else
+        offset = self.HEADER.size + (write % self.capacity) * self.SLOT.size
+        self.SLOT.pack_into(self.shm.buf, offset, t, sound_index)
+        struct.pack_into("Q", self.shm.buf, 8, write + 1)  # publish the event
+        return True
+
+    def pop_all(self) -> list[tuple[float, int]]:
+        write, read = self._indexes()
+        events = []
+        for i in range(read, write):
+            offset = self.HEADER.size + (i % self.capacity) * self.SLOT.size
+            events.append(self.SLOT.unpack_from(self.shm.buf, offset))
+        #
+        struct.pack_into("Q", self.shm.buf, 16, write)
+        return events
+
+    def skip(self) -> None:
+        """
+        Drop the pending events.
+        """
+        write, _ = self._indexes()
+        struct.pack_into("Q", self.shm.buf, 16, write)
+
+    def close(self) -> None:
+        self.shm.close()
+
+
+class AudioProcess:
+    def __init__(self, sound: Sound, shared_bank: bool, idle_timeout: float) -> None:
+        """
+        `sound`: used for mapping a key_id to a sound index (it's not loaded here)
+        """
+        self.sound = sound
+        self.config = {
+            "path": sound.sounds_dir,
+            "keysound": sound.ks_json,
+            "key_files": sound.key_files,
+            "trim_silence": sound.trim_silence,
+            "stream_threshold": sound.stream_threshold,
+            "shared_bank": shared_bank,
+            "idle_timeout": idle_timeout,
+        }
+        self.indexes = {id(key): i for i, key in enumerate(sound.collect_keys())}
+        self.ring: RingBuffer | None = None
+        self.proc: subprocess.Popen | None = None
+        self.restarts = 0
+        self._lock = threading.Lock()  # the keyboard and the mouse listeners both push
+        self._stopping = False
+
+    def _spawn(self) -> subprocess.Popen:
+        assert self.ring is not None
+        cmd = [
+            sys.executable,
+            "-m",
+            "keysound.audio_process",
+            self.ring.name,
+            json.dumps(self.config),
+        ]
+        # new session: Ctrl+C in the terminal doesn't reach the child,
+        # it exits when the main process closes its stdin
+        proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, cwd=PACKAGE_PARENT, start_new_session=True
+        )
+        os.set_blocking(proc.stdin.fileno(), False)  # type: ignore
+        return proc
+
+    def start(self) -> None:
+        self.ring = RingBuffer.create()
+        self.proc = self._spawn()
+        threading.Thread(target=self._supervise, daemon=True).start()
+
+    def _supervise(self) -> None:
+        backoff = 0.1
+        while True:
+            proc = self.proc
+            assert proc is not None
+            started = monotonic()
+            code = proc.wait()
+            if self._stopping:
+                return
+            # else
+            if monotonic() - started > 10:
+                backoff = 0.1  # it ran for a while, not a crash loop
+            print(f"# audio engine exited (code {code}), restarting in {backoff:.1f} sec")
+            sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            with self._lock:
+                if self._stopping:
+                    return
+                # else
+                self.proc = self._spawn()
+                self.restarts += 1
+            #
+        #
+
+    def trigger(self, key_id: Hashable) -> None:
+        """
+        Non-blocking. The event is dropped if the child is late (the ring is full).
+        """
+        index = self.indexes[id(self.sound.get(key_id))]
+        with self._lock:
+            if self.ring is None or self.proc is None or not self.ring.push(monotonic(), index):
+                return
+            # else
+            try:
+                os.write(self.proc.stdin.fileno(), b"\0")  # type: ignore
+            except (BlockingIOError, BrokenPipeError):
+                # pipe full: the child has a lot to read anyway
+                # broken pipe: the child died, the supervisor restarts it
+                pass
+            #
+        #
+
+    def close(self) -> None:
+        with self._lock:
+            self._stopping = True
+        #
+        if self.proc is not None:
+            self.proc.stdin.close()  # type: ignore
+            try:
+                self.proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+            #
+            self.proc = None
+        #
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.shm.unlink()
+            self.ring = None
+
+
+def run_engine(ring: RingBuffer, config: dict[str, Any]) -> None:
+    """
+    The main loop of the child process.
+    """
+    sound = Sound(
+        config["path"],
+        config["keysound"],
+        config["key_files"],
+        trim_silence=config["trim_silence"],
+        stream_threshold=config["stream_threshold"],
+    )
+    if config["shared_bank"]:
+        sound.use_shared_bank()
+    sound.preload()
+    keys = sound.collect_keys()
+    #
+
+    def close_audio() -> None:
+        sound.suspend()
+        print("# idle: output stream closed")
+
+    idle_monitor = IdleMonitor(config["idle_timeout"], on_idle=close_audio)
+    idle_monitor.start()
+    ring.skip()  # events that arrived while we were (re)starting are late anyway
+    fd = sys.stdin.fileno()
+    while os.read(fd, 4096):  # empty: the main process closed the pipe
+        for t, index in ring.pop_all():
+            if monotonic() - t > MAX_DELAY:
+                continue
+            # else
+            start = perf_counter()
+            woke = idle_monitor.touch()
+            keys[index].play()
+            if woke:
+                print(f"# active: wake-up latency {(perf_counter() - start) * 1000:.1f} ms")
+            #
+        #
+    #
+    sound.close()
+
+
+def main() -> None:
+    ring = RingBuffer.attach(sys.argv[1])
+    try:
+        run_engine(ring, json.loads(sys.argv[2]))
+    finally:
+        ring.close()
+
+
+##############################################################################
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Embeddable API.
+
+Use keysound from your own program (editor, terminal emulator, test
+harness) without the command-line application, i.e. without global
+config and without keyboard / mouse listeners:
+
+    from keysound import Engine
+
+    with Engine("fallout") as engine:
+        engine.trigger("enter")
+        engine.trigger_many([(0.0, "a"), (0.1, "b"), (0.2, "space")])
+    # leaving the with block waits until the sounds are played (see wait())
+
+A key_id is either "enter", "space", "key_up", "mouse_down", "mouse_up",
+or anything hashable (e.g. a character), which is mapped to one of the
+key*.wav files of the pack.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+from pathlib import Path
+from time import monotonic
+from typing import Any, Hashable, Iterable
+
+from keysound.index import SoundpackIndex, default_index_file, key_files, scan_pack
+from keysound.sound import Sound
+from keysound.stream import STREAM_THRESHOLD
+
+# the soundpacks that come with keysound
+DEFAULT_SOUNDS_DIR = str(Path(__file__).resolve().parent.parent / "sounds")
+
+
+def find_pack(pack: str, roots: list[str] | None, index_file: str | None) -> dict[str, Any]:
+    """
+    `pack` is either the name of a soundpack (looked up in the index)
+    or the path of a soundpack folder.
+    """
+    if os.path.isdir(pack):
+        path = os.path.normpath(os.path.abspath(pack))
+        return scan_pack(Path(path).name, path, os.stat(path).st_mtime_ns)
+    # else
+    index = SoundpackIndex(roots or [DEFAULT_SOUNDS_DIR], index_file or default_index_file())
+    index.load()
+    index.update()
+    entry = index.get(pack)
+    if entry is None:
+        raise ValueError(f"soundpack not found: {pack} (available: {', '.join(index.names())})")
+    # else
+    return entry
+
+
+class Engine:
+    def __init__(
+        self,
+        pack: str = "default",
+        *,
+        roots: list[str] | None = None,
+        index_file: str | None = None,
+        shared_bank: bool = False,
+        trim_silence: bool = True,
+        stream_threshold: int = STREAM_THRESHOLD,
+    ) -> None:
+        """
+        `pack`: name of a soundpack (see `roots`) or path of a soundpack folder
+        `roots`: folders with soundpacks (default: the bundled sounds/ folder)
+        `index_file`: the soundpack index (default: ~/.cache/keysound/index.json)
+        `shared_bank`: share the decoded samples with other keysound instances
+        `trim_silence`: cut the leading / trailing silence of the samples
+        `stream_threshold`: files larger than this (in bytes) are streamed (0: never)
+
+        All the samples are decoded here (only the head of the streamed ones),
+        thus trigger() doesn't wait for the disk.
+        """
+        entry = find_pack(pack, roots, index_file)
+        if not entry["valid"]:
+            raise ValueError(f"invalid soundpack {pack}: {', '.join(entry['errors'])}")
+        # else
+        self.sound = Sound(
+            entry["path"],
+            entry["keysound"] or {},
+            key_files(entry),
+            trim_silence=trim_silence,
+            stream_threshold=stream_threshold,
+            own_streams=True,  # don't stop the sounds of each other (or of another Engine)
+        )
+        if shared_bank:
+            self.sound.use_shared_bank()
+        self.sound.preload()
+        #
+        self._queue: list[tuple[float, int, Hashable]] = []  # heap of (when, seq, key_id)
+        self._seq = itertools.count()  # keeps the order of events with the same time
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._busy = False  # the scheduler thread is playing an event
+        self._closed = False
+
+    def trigger(self, key_id: Hashable) -> None:
+        """
+        Play the sound of a key. It returns immediately.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("the engine is closed")
+            #
+        #
+        self.sound.play_sound(key_id)
+
+    def trigger_many(self, events: Iterable[tuple[float, Hashable]]) -> None:
+        """
+        Schedule a batch of sounds. `events` is a list of (t, key_id) pairs,
+        where t is the delay in seconds (relative to this call).
+        It returns immediately; the sounds are played by a scheduler thread.
+        """
+        now = monotonic()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("the engine is closed")
+            # else
+            for t, key_id in events:
+                heapq.heappush(self._queue, (now + t, next(self._seq), key_id))
+            #
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            #
+            self._cond.notify_all()
+
+    def cancel(self) -> None:
+        """
+        Drop the scheduled sounds that haven't been played yet.
+        """
+        with self._cond:
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def wait(self) -> None:
+        """
+        Wait until the scheduled sounds are played and every sound has finished.
+        """
+        with self._cond:
+            while (self._queue or self._busy) and not self._closed:
+                self._cond.wait()
+            #
+        #
+        for key in self.sound.collect_keys():
+            for stream in key.streams:
+                stream.finished.wait()
+            #
+        #
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    # else
+                    remaining = self._queue[0][0] - monotonic()
+                    if remaining <= 0:
+                        break
+                    # else
+                    self._cond.wait(remaining)
+                #
+                if self._closed:
+                    return
+                # else
+                _, _, key_id = heapq.heappop(self._queue)
+                self._busy = True
+            #
+            try:
+                self.sound.play_sound(key_id)
+            except Exception as e:
+                # don't let the scheduler thread die, the next events are played
+                print(f"# couldn't play {key_id!r}: {e!r}")
+            #
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+            #
+        #
+
+    def close(self) -> None:
+        """
+        Stop at once: the scheduled sounds are dropped, the playing ones are cut.
+        Call wait() before it to let them finish.
+        """
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+        #
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        #
+        self.sound.close()
+
+    def __enter__(self) -> "Engine":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        if exc_type is None:
+            self.wait()
+        self.close()
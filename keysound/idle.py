@@ -0,0 +1,74 @@
+"""
+Idle power mode.
+
+keysound is silent most of the time. After `timeout` seconds without
+any input, the `on_idle` callback is called (it closes the output
+stream). It's called without holding the lock, thus an input event
+at that moment doesn't wait for it.
+
+The watcher thread doesn't poll: while active, it sleeps until the
+timeout could expire; while idle, it sleeps until it's woken up by
+an input event.
+"""
+
+import threading
+from time import monotonic
+from typing import Callable
+
+
+class IdleMonitor:
+    def __init__(self, timeout: float, on_idle: Callable[[], None]) -> None:
+        self.timeout = timeout
+        self.on_idle = on_idle
+        self.idle = False
+        self.last_activity = monotonic()
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def enabled(self) -> bool:
+        return self.timeout > 0
+
+    def start(self) -> None:
+        if not self.enabled():
+            return
+        # else
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def touch(self) -> bool:
+        """
+        Call it on every input event, before playing a sound.
+        Returns True if we were idle.
+        """
+        with self._lock:
+            self.last_activity = monotonic()
+            if not self.idle:
+                return False
+            # else
+            self.idle = False
+        #
+        self._event.set()  # the watcher thread sleeps while idle, wake it up
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                self._event.clear()
+                idle = self.idle
+                remaining = self.last_activity + self.timeout - monotonic()
+                went_idle = not idle and remaining <= 0
+                if went_idle:
+                    self.idle = True
+                #
+            #
+            if went_idle:
+                self.on_idle()
+                continue
+            #
+            if idle:
+                self._event.wait()
+            else:
+                self._event.wait(remaining)
+            #
+        #
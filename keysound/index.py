@@ -0,0 +1,234 @@
+"""
+Soundpack index.
+
+Scanning every soundpack folder at startup gets slow with a large
+library (hundreds of Mechvibes packs). Instead, we keep a persisted
+index (a JSON file) with the name, path, file list, key mapping and
+validation status of each pack. At startup only the pack folders, their
+keysound.json and the files it refers to are stat'ed. A pack is re-scanned
+only if one of these mtimes changed.
+
+Several pack roots are supported. If the same pack name appears in
+more than one root, the first root wins. The entries are stored per root,
+thus using a different set of roots doesn't invalidate the index.
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+
+INDEX_VERSION = 2
+
+# these names can't be used as a soundpack name
+RESERVED_NAMES = ("random",)
+
+# these files must be present in every soundpack (after applying keysound.json)
+REQUIRED_FILES = ("enter.wav", "space.wav", "key_up.wav", "mouse_down.wav", "mouse_up.wav")
+
+
+def default_index_file() -> str:
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return str(Path(cache_dir, "keysound", "index.json"))
+
+
+def normalize_root(root: str) -> str:
+    return os.path.realpath(root)
+
+
+def _mtime(path: str) -> int | None:
+    """
+    None if the file doesn't exist.
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _deps(path: str, mapping: dict[str, str] | None) -> dict[str, int | None]:
+    """
+    The files (outside of the pack folder's own mtime) that the entry depends on:
+    keysound.json and the files it refers to (e.g. ../_shared/*.wav).
+    """
+    fnames = [str(Path(path, "keysound.json"))]
+    fnames.extend(os.path.normpath(Path(path, value)) for value in (mapping or {}).values())
+    return {fname: _mtime(fname) for fname in fnames}
+
+
+def is_fresh(entry: dict[str, Any], path: str, mtime: int) -> bool:
+    """
+    True if the entry of a pack is still valid (nothing changed since the scan).
+    """
+    if entry["path"] != path or entry["mtime"] != mtime:
+        return False
+    # else
+    return all(_mtime(fname) == m for fname, m in entry["deps"].items())
+
+
+def _read_key_mapping(path: str) -> dict[str, str] | None:
+    """
+    Returns the content of keysound.json, or None if the pack doesn't have one.
+    """
+    try:
+        with open(Path(path, "keysound.json")) as f:
+            return json.load(f)  # type: ignore
+        #
+    except:
+        return None
+
+
+def _validate(entry: dict[str, Any]) -> list[str]:
+    """
+    Same checks as Sound.missing() in sound.py, but done at indexing time.
+    Returns the list of problems (an empty list means the pack is valid).
+    """
+    errors = []
+    mapping = entry["keysound"] or {}
+    for fname in REQUIRED_FILES:
+        stem = Path(fname).stem
+        if stem in mapping:
+            fname = mapping[stem]
+            if not os.path.isfile(Path(entry["path"], fname)):
+                errors.append(f"{fname} doesn't exist")
+            #
+        elif fname not in entry["files"]:
+            errors.append(f"{fname} doesn't exist")
+        #
+    #
+    if not any(f.startswith("key") and f.endswith(".wav") for f in entry["files"]):
+        errors.append("no key*.wav files")
+    #
+    return errors
+
+
+def key_files(entry: dict[str, Any]) -> list[str]:
+    """
+    The key*.wav files of a pack (in a stable order).
+    """
+    return sorted(f for f in entry["files"] if f.startswith("key") and f.endswith(".wav"))
+
+
+def scan_pack(name: str, path: str, mtime: int) -> dict[str, Any]:
+    """
+    Scan a soundpack folder and return its index entry.
+    """
+    files = {}
+    with os.scandir(path) as it:
+        for e in it:
+            if e.is_file():
+                st = e.stat()
+                files[e.name] = [st.st_size, st.st_mtime_ns]
+            #
+        #
+    #
+    mapping = _read_key_mapping(path)
+    entry: dict[str, Any] = {
+        "name": name,
+        "path": path,
+        "mtime": mtime,
+        "files": files,
+        "keysound": mapping,
+        "deps": _deps(path, mapping),
+    }
+    entry["errors"] = _validate(entry)
+    entry["valid"] = not entry["errors"]
+    return entry
+
+
+class SoundpackIndex:
+    def __init__(self, roots: list[str], index_file: str) -> None:
+        self.roots = [normalize_root(root) for root in roots]
+        self.index_file = index_file
+        self.packs: dict[str, dict[str, Any]] = {}  # name -> entry (of the selected roots)
+        self.by_root: dict[str, dict[str, dict[str, Any]]] = {}  # root -> name -> entry
+        self.rescanned: list[str] = []  # names of the packs re-scanned by the last update()
+
+    def load(self) -> None:
+        try:
+            with open(self.index_file) as f:
+                data = json.load(f)
+            #
+        except:
+            return
+        # else
+        if data.get("version") == INDEX_VERSION:
+            self.by_root = data["roots"]
+
+    def save(self) -> None:
+        # the entries of the other roots are kept (another program may use them)
+        data = {"version": INDEX_VERSION, "roots": self.by_root}
+        try:
+            index_dir = os.path.dirname(self.index_file)
+            os.makedirs(index_dir, exist_ok=True)
+            # a unique temporary file: other keysound instances may save at the same time
+            fd, tmp = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f)
+                #
+                os.replace(tmp, self.index_file)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            #
+        except OSError as e:
+            # the index is just a cache, we can live without it
+            print(f"# couldn't save the soundpack index: {e}")
+
+    def update(self, full: bool = False) -> None:
+        """
+        Re-scan the packs that were modified (or all of them if `full` is True).
+        Packs that disappeared are removed from the index.
+        """
+        self.packs = {}
+        self.rescanned = []
+        changed = False
+        for root in self.roots:
+            if not os.path.isdir(root):
+                print(f"# soundpack root {root} doesn't exist")
+                continue
+            # else
+            old = self.by_root.get(root, {})
+            new = {}
+            with os.scandir(root) as it:
+                for e in it:
+                    if e.name.startswith("_") or not e.is_dir():
+                        continue
+                    # else
+                    mtime = e.stat().st_mtime_ns
+                    path = os.path.normpath(e.path)
+                    prev = old.get(e.name)
+                    if full or not prev or not is_fresh(prev, path, mtime):
+                        new[e.name] = scan_pack(e.name, path, mtime)
+                        self.rescanned.append(e.name)
+                    else:
+                        new[e.name] = prev
+                    #
+                #
+            #
+            if new.keys() != old.keys():
+                changed = True
+            self.by_root[root] = new
+            for name, entry in new.items():
+                self.packs.setdefault(name, entry)  # the first root wins
+            #
+        #
+        if self.rescanned or changed:
+            self.save()
+
+    def names(self) -> list[str]:
+        return sorted(self.packs)
+
+    def valid_names(self) -> list[str]:
+        return sorted(name for name, entry in self.packs.items() if entry["valid"])
+
+    def get(self, name: str) -> dict[str, Any] | None:
+        return self.packs.get(name)
+
+    def path(self, name: str) -> str:
+        return self.packs[name]["path"]  # type: ignore
+
+    def key_files(self, name: str) -> list[str]:
+        return key_files(self.packs[name])
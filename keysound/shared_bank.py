@@ -0,0 +1,359 @@
+"""
+Shared-memory sample bank.
+
+If several keysound instances run on the same machine (multi-seat,
+terminal server), each of them would decode the same soundpack and keep
+its own copy in memory. With the shared bank, the decoded samples of a
+pack are put in a named POSIX shared memory segment (a file in /dev/shm,
+Linux only). The first instance decodes the pack, the others simply map
+the same buffers.
+
+The segment is created once, with mode 0644. After it's filled, every
+instance (the creator too) maps it with O_RDONLY and PROT_READ, thus the
+samples are read-only at the OS level. Instances of other users can map
+it too. The samples are stored as float32 (half the size of float64).
+
+While the creator fills the segment, it holds an exclusive flock on it.
+If an instance finds an unfilled segment that nobody locks, its creator
+died: the segment is removed and created again.
+
+Layout of a segment:
+
+    [header length: uint32][JSON header][padding][sample data]
+
+The JSON header maps each file name to its offset (relative to the start
+of the sample data), shape, dtype, sample rate and the non-silent part
+of the sample (see trim.py). A header length of 0 means that the segment
+is not filled (yet). The silence analysis is done once, by the instance
+that decodes the pack; the samples are stored with the fade-in applied.
+
+Reference counting: each instance creates a pid file (<segment>.<pid>) in
+a shared, sticky directory. When an instance detaches, it removes its pid
+file, and if no live instance is left, it removes the segment. Pid files
+of dead processes don't count, thus a killed instance doesn't keep the
+segment alive. If the segment belongs to another user, we can't remove
+it; it's reused by the next instance.
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import stat
+import struct
+import tempfile
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Any
+
+import numpy as np
+import soundfile as sf
+
+from keysound.trim import Trim, apply_fade_in, find_sound
+
+SHM_DIR = "/dev/shm"
+PREFIX = struct.Struct("I")  # header length
+ALIGN = 64
+READY_TIMEOUT = 10.0  # seconds to wait for another instance to fill the segment
+ABANDONED_AFTER = 0.5  # an unfilled segment that nobody locks for this long is abandoned
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def bank_name(fnames: list[str], trim_silence: bool) -> str:
+    """
+    The name of the segment depends on the files (path, size, mtime).
+    If a file of the pack changes, a new segment is created.
+    """
+    h = hashlib.sha1()
+    h.update(f"trim={trim_silence}\0".encode())
+    for fname in sorted(fnames):
+        st = os.stat(fname)
+        h.update(f"{fname}\0{st.st_size}\0{st.st_mtime_ns}\0".encode())
+    #
+    return f"keysound-{h.hexdigest()[:16]}"
+
+
+def _usable_shared_dir(path: str) -> bool:
+    """
+    A real directory (not a symlink), world-writable and sticky, like /tmp.
+    """
+    st = os.lstat(path)
+    mode = stat.S_IMODE(st.st_mode)
+    return stat.S_ISDIR(st.st_mode) and mode & 0o1777 == 0o1777
+
+
+def refs_dir() -> str:
+    """
+    The directory of the pid files. It's shared by all users. If it can't be
+    used (e.g. another user created something else with this name), we fall
+    back to a private directory: the bank still works, but the instances of
+    other users don't see our references.
+    """
+    path = str(Path(tempfile.gettempdir(), "keysound-bank"))
+    try:
+        try:
+            os.mkdir(path)
+            os.chmod(path, 0o1777)  # mkdir's mode is limited by the umask
+        except FileExistsError:
+            pass
+        #
+        if _usable_shared_dir(path):
+            return path
+        #
+    except OSError:
+        pass
+    # else
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    private = str(Path(cache_dir, "keysound", "bank"))
+    print(f"# {path} can't be used, references are kept in {private}")
+    os.makedirs(private, mode=0o700, exist_ok=True)
+    return private
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # it belongs to another user
+    # else
+    return True
+
+
+class SharedBank:
+    def __init__(self, fnames: list[str], trim_silence: bool = False) -> None:
+        """
+        `fnames`: the audio files (with path) to be put in the bank.
+        `trim_silence`: the samples are played without their leading / trailing silence
+        """
+        self.fnames = sorted(set(fnames))
+        self.trim_silence = trim_silence
+        self.name = bank_name(self.fnames, trim_silence)
+        self.path = str(Path(SHM_DIR, self.name))
+        self.refs_dir = refs_dir()
+        self.pid_file: str | None = None
+        self.mm: mmap.mmap | None = None
+        self.created = False  # True if this instance decoded the samples
+        self.samples: dict[str, tuple[np.ndarray, int]] = {}  # fname -> (data, samplerate)
+        self.trims: dict[str, Trim] = {}  # fname -> Trim (if trim_silence is True)
+
+    def _add_ref(self) -> None:
+        pid_file = str(Path(self.refs_dir, f"{self.name}.{os.getpid()}"))
+        try:
+            fd = os.open(pid_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.close(fd)
+            self.pid_file = pid_file
+        except OSError as e:
+            # without a reference, another instance may remove the name of the
+            # segment; our mapping stays valid, so it's not fatal
+            print(f"# couldn't create {pid_file}: {e}")
+
+    def _remove_ref(self) -> None:
+        if self.pid_file:
+            try:
+                os.unlink(self.pid_file)
+            except OSError:
+                pass
+            self.pid_file = None
+
+    def _live_refs(self) -> int:
+        count = 0
+        prefix = f"{self.name}."
+        for entry in os.listdir(self.refs_dir):
+            if not entry.startswith(prefix):
+                continue
+            # else
+            pid = entry[len(prefix) :]
+            if pid.isdigit() and _is_alive(int(pid)):
+                count += 1
+            else:
+                try:
+                    os.unlink(Path(self.refs_dir, entry))
+                except OSError:
+                    pass  # a stale file of another user (sticky directory)
+                #
+            #
+        #
+        return count
+
+    def _create(self) -> bool:
+        """
+        Decode the samples and fill the segment.
+        Returns False if another instance is creating it.
+        """
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        # else
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)  # released when fd is closed (or if we die)
+            os.fchmod(fd, 0o644)  # the mode of os.open() is limited by the umask
+            decoded = {fname: sf.read(fname, dtype="float32") for fname in self.fnames}
+            header: dict[str, Any] = {}
+            offset = 0
+            for fname, (data, samplerate) in decoded.items():
+                trim = None
+                if self.trim_silence:
+                    trim = find_sound(data, samplerate)
+                    apply_fade_in(data, trim)
+                header[fname] = {
+                    "offset": offset,
+                    "shape": data.shape,
+                    "dtype": data.dtype.str,
+                    "samplerate": samplerate,
+                    "trim": [trim.start, trim.end] if trim else None,
+                }
+                offset = _align(offset + data.nbytes)
+            #
+            raw_header = json.dumps(header).encode()
+            data_start = _align(PREFIX.size + len(raw_header))
+            os.ftruncate(fd, max(data_start + offset, PREFIX.size))
+            with mmap.mmap(fd, 0) as mm:
+                for fname, (data, _) in decoded.items():
+                    start = data_start + header[fname]["offset"]
+                    mm[start : start + data.nbytes] = data.tobytes()
+                #
+                mm[PREFIX.size : PREFIX.size + len(raw_header)] = raw_header
+                PREFIX.pack_into(mm, 0, len(raw_header))  # written last: the segment is ready
+            #
+        except BaseException:
+            os.unlink(self.path)
+            raise
+        finally:
+            os.close(fd)
+        #
+        self.created = True
+        return True
+
+    def _is_filled(self, fd: int) -> bool:
+        raw = os.pread(fd, PREFIX.size, 0)
+        return len(raw) == PREFIX.size and PREFIX.unpack(raw)[0] > 0
+
+    def _is_locked(self, fd: int) -> bool:
+        """
+        True if the creator is filling the segment.
+        """
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        # else
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return False
+
+    def _remove_abandoned(self, fd: int) -> None:
+        """
+        Remove the segment of a dead creator. Under the lock, and only if the name
+        still refers to this (unfilled) segment: another instance may have removed
+        it and created a new one meanwhile.
+        """
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if not self._is_filled(fd) and os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                print(f"# {self.path} was abandoned by its creator, removing it")
+                os.unlink(self.path)
+            #
+        except FileNotFoundError:
+            pass
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _open(self) -> mmap.mmap | None:
+        """
+        Map the segment read-only. None if it doesn't exist (or it was abandoned).
+        Waits if another instance is still filling it.
+        """
+        deadline = monotonic() + READY_TIMEOUT
+        unlocked_since = None  # the creator locks the segment right after creating it
+        while True:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except FileNotFoundError:
+                return None
+            # else
+            try:
+                if os.fstat(fd).st_size >= PREFIX.size:
+                    mm = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+                    if PREFIX.unpack_from(mm, 0)[0] > 0:
+                        return mm
+                    # else
+                    mm.close()
+                #
+                if self._is_locked(fd):
+                    unlocked_since = None
+                elif unlocked_since is None:
+                    unlocked_since = monotonic()
+                elif monotonic() - unlocked_since > ABANDONED_AFTER:
+                    self._remove_abandoned(fd)
+                    return None
+                #
+            finally:
+                os.close(fd)
+            #
+            if monotonic() > deadline:
+                raise OSError(f"{self.path} is not filled (did its creator die?)")
+            # else
+            sleep(0.01)
+        #
+
+    def attach(self) -> None:
+        """
+        Raises OSError if the bank can't be used.
+        """
+        self._add_ref()  # before opening: a detaching instance won't remove the segment
+        try:
+            mm = self._open()
+            if mm is None:
+                self._create()  # if another instance was faster, _open() waits for it
+                mm = self._open()
+            if mm is None:
+                raise OSError(f"{self.path} disappeared")
+            #
+        except OSError:
+            self._remove_ref()
+            raise
+        #
+        self.mm = mm
+        (header_len,) = PREFIX.unpack_from(mm, 0)
+        header = json.loads(mm[PREFIX.size : PREFIX.size + header_len])
+        data_start = _align(PREFIX.size + header_len)
+        for fname, info in header.items():
+            dtype = np.dtype(info["dtype"])
+            shape = tuple(info["shape"])
+            data = np.frombuffer(
+                mm, dtype=dtype, count=int(np.prod(shape)), offset=data_start + info["offset"]
+            ).reshape(shape)
+            if info["trim"]:
+                start, end = info["trim"]
+                self.trims[fname] = Trim(start, end, len(data), info["samplerate"])
+                data = data[start:end]
+            self.samples[fname] = (data, info["samplerate"])
+        #
+
+    def detach(self) -> None:
+        if self.mm is None:
+            return
+        # else
+        mm = self.mm
+        self.mm = None
+        self.samples.clear()
+        self.trims.clear()
+        self._remove_ref()
+        if self._live_refs() == 0:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass  # already removed, or it belongs to another user
+            #
+        #
+        try:
+            mm.close()
+        except BufferError:
+            # some numpy views are still alive; the mapping goes away when the process exits
+            pass
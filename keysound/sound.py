@@ -0,0 +1,263 @@
+"""
+The sound files of a soundpack and their playback.
+
+Nothing here depends on the command-line application (no global
+config, no keyboard / mouse listeners), thus it can be used
+by the Engine too.
+"""
+
+import atexit
+import os
+from enum import Enum, auto
+from pathlib import Path
+from typing import Any, Hashable
+
+import simpleaudio as sa
+import sounddevice as sd
+import soundfile as sf
+
+from keysound.stream import STREAM_THRESHOLD, Stream, load_head, play_stream
+from keysound.trim import Trim, trim_silence
+
+# these sounds have their own file, every other key_id is mapped to a key*.wav file
+NAMED_SOUNDS = ("enter", "space", "key_up", "mouse_down", "mouse_up")
+
+
+# constants
+class C(Enum):
+    # Priority 1: play with sounddevice+soundfile
+    SD_SF = auto()
+    # Priority 2: play with simpleaudio
+    SA = auto()
+    # Priority 3: play in an external process (use this if you have problems with the previous two)
+    # this is a fallback solution
+    EXTERNAL = auto()
+
+
+class SoundFile:
+    def __init__(self, sounds_dir: str, fname: str, playback=C.SD_SF) -> None:
+        """
+        Default playback method: sounddevice+soundfile
+        It plays most .wav files correctly. If there's a problem with
+        a particular .wav file, we can set a different playback method for it.
+        """
+        self.name = Path(fname).name
+        self.fname_with_path = os.path.normpath(Path(sounds_dir, fname))
+        self.playback = playback
+        self.loaded = False
+        self.data: Any = None  # will be set after loading the .wav file
+        self.trim_silence = False  # play the sound without its leading / trailing silence
+        self.trim: Trim | None = None  # set when the file is loaded (if trim_silence is True)
+        self.stream_threshold = 0  # stream the file if it's larger than this (0: never)
+        self.streamed = False  # set when the file is loaded, see is_streamed()
+        self.own_stream = False  # play in a new stream instead of sd.play(), see Sound
+        self.streams: list[Stream] = []  # the playbacks in their own stream
+        # special cases
+
+        if self.name.startswith("mouse"):
+            self.playback = C.SA
+        if sounds_dir.endswith("banana") and self.name.startswith("enter"):
+            self.playback = C.EXTERNAL
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.fname_with_path)
+
+    def is_streamed(self) -> bool:
+        """
+        Long samples are not loaded entirely. Only their head is kept in memory.
+        """
+        return (
+            self.playback == C.SD_SF
+            and self.stream_threshold > 0
+            and os.path.getsize(self.fname_with_path) > self.stream_threshold
+        )
+
+    def _load(self):
+        self.streamed = self.is_streamed()
+        if self.streamed:
+            head, samplerate, rest_start, self.trim = load_head(
+                self.fname_with_path, self.trim_silence
+            )
+            self.data = (head, samplerate, rest_start)
+        elif self.playback == C.SD_SF:
+            # float32: sd.OutputStream (see own_stream) doesn't accept float64
+            data, samplerate = sf.read(self.fname_with_path, dtype="float32")
+            if self.trim_silence:
+                data, self.trim = trim_silence(data, samplerate)
+            self.data = (data, samplerate)
+        elif self.playback == C.SA:
+            self.data = sa.WaveObject.from_wave_file(self.fname_with_path)
+        #
+        self.loaded = True
+
+    def _start_stream(self, fname: str | None, head, samplerate: int, rest_start: int) -> None:
+        for stream in self.streams:
+            if stream.finished.is_set():
+                stream.close()
+            #
+        #
+        self.streams = [stream for stream in self.streams if not stream.finished.is_set()]
+        self.streams.append(play_stream(fname, head, samplerate, rest_start))
+
+    def _play_sound(self):
+        if self.streamed:
+            self._start_stream(self.fname_with_path, *(self.data))
+        elif self.playback == C.SD_SF and self.own_stream:
+            data, samplerate = self.data
+            self._start_stream(None, data, samplerate, len(data))
+        elif self.playback == C.SD_SF:
+            sd.play(*(self.data))
+        elif self.playback == C.SA:
+            self.data.play()
+        elif self.playback == C.EXTERNAL:
+            cmd = f"play -q '{self.fname_with_path}' &"
+            os.system(cmd)
+        else:
+            assert False, "Error: unknown playback method"
+
+    def play(self):
+        if not self.loaded:
+            self._load()
+        #
+        self._play_sound()
+
+    def __str__(self) -> str:
+        result = f"{self.name}"
+        return result
+
+
+class Sound:
+    def __init__(
+        self,
+        sounds_dir: str,
+        ks_json: dict[str, str],
+        key_files: list[str],
+        trim_silence: bool = True,
+        stream_threshold: int = STREAM_THRESHOLD,
+        own_streams: bool = False,
+    ) -> None:
+        """
+        `ks_json`: content of the pack's keysound.json
+        `key_files`: the key*.wav files of the pack
+        `trim_silence`: cut the leading / trailing silence of the samples
+        `stream_threshold`: files larger than this (in bytes) are streamed (0: never)
+        `own_streams`: every sound is played in its own output stream. sd.play() uses
+        one global stream, thus a new sound stops the previous one (in the whole process).
+        """
+        self.sounds_dir = sounds_dir
+        self.ks_json = ks_json
+        self.key_files = key_files
+        self.trim_silence = trim_silence
+        self.stream_threshold = stream_threshold
+        #
+        self.enter = SoundFile(sounds_dir, "enter.wav")
+        self.space = SoundFile(sounds_dir, "space.wav")
+        self.keys = [SoundFile(sounds_dir, fname) for fname in key_files]
+        self.key_up = SoundFile(sounds_dir, "key_up.wav")
+        #
+        self.mouse_down = SoundFile(sounds_dir, "mouse_down.wav")
+        self.mouse_up = SoundFile(sounds_dir, "mouse_up.wav")
+        #
+        self.prev_key: Any = None
+        self.bank: Any = None  # SharedBank, if used
+        #
+        if "mouse_down" in ks_json:
+            value = ks_json["mouse_down"]
+            self.mouse_down = SoundFile(sounds_dir, value)
+        if "mouse_up" in ks_json:
+            value = ks_json["mouse_up"]
+            self.mouse_up = SoundFile(sounds_dir, value)
+        if "key_up" in ks_json:
+            value = ks_json["key_up"]
+            self.key_up = SoundFile(sounds_dir, value)
+        #
+        for key in self.collect_keys():
+            key.trim_silence = trim_silence
+            key.stream_threshold = stream_threshold
+            key.own_stream = own_streams
+        #
+
+    def collect_keys(self) -> list[SoundFile]:
+        li = [self.enter, self.space, self.key_up, self.mouse_down, self.mouse_up]
+        li.extend(self.keys)
+        return li
+
+    def missing(self) -> list[SoundFile]:
+        return [key for key in self.collect_keys() if not key.exists()]
+
+    def use_shared_bank(self) -> None:
+        """
+        Take the decoded samples from shared memory (decode them only if
+        no other keysound instance did it before).
+        """
+        from keysound.shared_bank import SharedBank  # POSIX only
+
+        # streamed files are not decoded entirely, they don't go in the bank
+        keys = [
+            key
+            for key in self.collect_keys()
+            if key.playback == C.SD_SF and not key.is_streamed()
+        ]
+        bank = SharedBank([key.fname_with_path for key in keys], self.trim_silence)
+        try:
+            bank.attach()
+        except OSError as e:
+            print(f"# the shared bank can't be used ({e}), samples are loaded locally")
+            return
+        # else
+        self.bank = bank
+        atexit.register(self.close)
+        for key in keys:
+            key.data = self.bank.samples[key.fname_with_path]
+            key.trim = self.bank.trims.get(key.fname_with_path)
+            key.loaded = True
+        #
+        if not self.bank.created:
+            print("# samples mapped from the shared bank")
+
+    def preload(self) -> None:
+        for key in self.collect_keys():
+            if not key.loaded:
+                key._load()
+            #
+        #
+
+    def suspend(self) -> None:
+        """
+        Close the output streams (when idle). PortAudio stays initialized and
+        the decoded samples stay in memory, thus the next sound doesn't have
+        to wait for anything: the next sound simply opens a new stream.
+        """
+        sd.stop()
+        self._close_streams()
+
+    def _close_streams(self) -> None:
+        """
+        Close the streams of the streamed files (and the own streams, see Engine).
+        """
+        for key in self.collect_keys():
+            for stream in key.streams:
+                stream.close()
+            #
+            key.streams = []
+        #
+
+    def close(self) -> None:
+        self._close_streams()
+        if self.bank is not None:
+            self.bank.detach()
+            self.bank = None
+
+    def get(self, key_id: Hashable) -> SoundFile:
+        """
+        The sound file of a key. `key_id` is either one of NAMED_SOUNDS
+        or anything hashable (e.g. a pynput Key or a character).
+        """
+        if isinstance(key_id, str) and key_id in NAMED_SOUNDS:
+            return getattr(self, key_id)  # type: ignore
+        # else
+        index = abs(hash(key_id)) % len(self.keys)
+        return self.keys[index]
+
+    def play_sound(self, key_id: Hashable) -> None:
+        self.get(key_id).play()
@@ -0,0 +1,144 @@
+"""
+Streaming playback of long samples.
+
+A long sample (ambient sound, multi-second effect) is not decoded
+entirely. Only its head (the first RESIDENT_BLOCKS blocks) stays in
+memory, thus playback can start immediately. The rest is read from the
+file in blocks by a feeder thread, through a bounded queue. Memory use
+doesn't depend on the length of the sample.
+"""
+
+import queue
+import threading
+
+import numpy as np
+import sounddevice as sd
+import soundfile as sf
+
+from keysound.trim import Trim, apply_fade_in, find_sound
+
+STREAM_THRESHOLD = 1024 * 1024  # files larger than this (in bytes) are streamed
+BLOCKSIZE = 2048  # frames
+RESIDENT_BLOCKS = 4  # this many blocks are kept in memory (the head of the sample)
+QUEUE_BLOCKS = 8  # at most this many blocks are read ahead
+
+_END = object()  # end of the sample (put in the queue)
+
+
+def load_head(fname: str, trim_silence: bool) -> tuple[np.ndarray, int, int, Trim | None]:
+    """
+    Read the head of a long sample.
+    Returns (head, samplerate, position of the first frame after the head, trim).
+    Only the leading silence can be trimmed (we don't read the end of the file).
+    """
+    with sf.SoundFile(fname) as f:
+        samplerate = f.samplerate
+        length = f.frames
+        head = f.read(BLOCKSIZE * RESIDENT_BLOCKS, dtype="float32", always_2d=True)
+    #
+    rest_start = len(head)
+    trim = None
+    if trim_silence:
+        found = find_sound(head, samplerate)
+        trim = Trim(found.start, length, length, samplerate)
+        apply_fade_in(head, trim)
+        head = head[trim.start :]
+    #
+    return head, samplerate, rest_start, trim
+
+
+class Stream:
+    def __init__(
+        self, fname: str | None, head: np.ndarray, samplerate: int, rest_start: int
+    ) -> None:
+        """
+        If `fname` is None, only `head` is played (a sample that is in memory).
+        """
+        if head.ndim == 1:
+            head = head.reshape(-1, 1)
+        self.fname = fname
+        self.rest_start = rest_start
+        self.queue: queue.Queue = queue.Queue(maxsize=QUEUE_BLOCKS)
+        self.finished = threading.Event()
+        self._buf: np.ndarray | None = head  # the block being played
+        self._pos = 0  # position in self._buf
+        self._stream = sd.OutputStream(
+            samplerate=samplerate,
+            channels=head.shape[1],
+            dtype=head.dtype.name,
+            blocksize=BLOCKSIZE,
+            callback=self._callback,
+            finished_callback=self.finished.set,
+        )
+
+    def close(self) -> None:
+        self.finished.set()  # stops the feeder too
+        self._stream.close()
+
+    def start(self) -> None:
+        if self.fname is None:
+            self.queue.put(_END)
+        else:
+            threading.Thread(target=self._feed, daemon=True).start()
+        self._stream.start()
+
+    def _feed(self) -> None:
+        assert self.fname is not None
+        with sf.SoundFile(self.fname) as f:
+            f.seek(self.rest_start)
+            for block in f.blocks(blocksize=BLOCKSIZE, dtype="float32", always_2d=True):
+                if not self._put(block):
+                    return
+                #
+            #
+        #
+        self._put(_END)
+
+    def _put(self, item) -> bool:
+        """
+        Wait for room in the queue. Returns False if the playback was stopped.
+        """
+        while not self.finished.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+            #
+        #
+        return False
+
+    def _callback(self, outdata, frames, time, status) -> None:
+        filled = 0
+        while filled < frames:
+            buf = self._buf
+            if buf is None or self._pos >= len(buf):
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    # the feeder is late: play silence, continue with the next callback
+                    self._buf = None
+                    outdata[filled:] = 0
+                    return
+                #
+                if item is _END:
+                    outdata[filled:] = 0
+                    raise sd.CallbackStop
+                # else
+                self._buf = item
+                self._pos = 0
+                continue
+            # else
+            n = min(frames - filled, len(buf) - self._pos)
+            outdata[filled : filled + n] = buf[self._pos : self._pos + n]
+            filled += n
+            self._pos += n
+        #
+
+
+def play_stream(
+    fname: str | None, head: np.ndarray, samplerate: int, rest_start: int
+) -> Stream:
+    stream = Stream(fname, head, samplerate, rest_start)
+    stream.start()
+    return stream
@@ -0,0 +1,112 @@
+"""
+Silence trimming.
+
+Some .wav files start with several milliseconds of (near) silence,
+which adds directly to the perceived latency of a keypress. When a
+sample is loaded, we find its leading and trailing silence and play
+a trimmed view of the decoded data (no copy). A short fade-in is
+applied where the sound starts to avoid clicks.
+"""
+
+from typing import Protocol, Sequence
+
+import numpy as np
+
+THRESHOLD_DB = -50.0  # samples below this level (dBFS) are considered silence
+FADE_MS = 1.0  # length of the fade-in before the first loud sample
+
+
+class Trim:
+    def __init__(self, start: int, end: int, length: int, samplerate: int) -> None:
+        """
+        The sound is data[start:end], the original data has `length` frames.
+        """
+        self.start = start
+        self.end = end
+        self.length = length
+        self.samplerate = samplerate
+
+    @property
+    def lead_ms(self) -> float:
+        return self.start / self.samplerate * 1000
+
+    @property
+    def tail_ms(self) -> float:
+        return (self.length - self.end) / self.samplerate * 1000
+
+
+def find_sound(data: np.ndarray, samplerate: int, threshold_db: float = THRESHOLD_DB) -> Trim:
+    """
+    Find the part of `data` (frames x channels, or frames) that is not silent.
+    The start includes FADE_MS before the first loud sample (room for the fade-in).
+    """
+    threshold = 10 ** (threshold_db / 20)
+    level = np.abs(data) if data.ndim == 1 else np.abs(data).max(axis=1)
+    loud = np.flatnonzero(level > threshold)
+    length = len(data)
+    if loud.size == 0:
+        return Trim(0, length, length, samplerate)
+    # else
+    fade = int(samplerate * FADE_MS / 1000)
+    start = max(int(loud[0]) - fade, 0)
+    end = int(loud[-1]) + 1
+    return Trim(start, end, length, samplerate)
+
+
+def apply_fade_in(data: np.ndarray, trim: Trim) -> None:
+    """
+    Fade in the beginning of the trimmed sound. It modifies `data` in place.
+    """
+    if trim.start == 0:
+        return
+    # else
+    n = min(int(trim.samplerate * FADE_MS / 1000), trim.end - trim.start)
+    ramp = np.linspace(0.0, 1.0, n, endpoint=False)
+    if data.ndim > 1:
+        ramp = ramp[:, np.newaxis]
+    data[trim.start : trim.start + n] *= ramp
+
+
+def trim_silence(data: np.ndarray, samplerate: int) -> tuple[np.ndarray, Trim]:
+    """
+    Returns the trimmed view of `data` and the Trim info.
+    `data` must be writable (the fade-in is applied in place).
+    """
+    trim = find_sound(data, samplerate)
+    apply_fade_in(data, trim)
+    return data[trim.start : trim.end], trim
+
+
+class Trimmed(Protocol):
+    """
+    A loaded sound file (see SoundFile in sound.py).
+    """
+
+    name: str
+    trim: Trim | None
+
+
+def print_report(name: str, sound_files: Sequence[Trimmed]) -> None:
+    """
+    Print the trimmed milliseconds of each (loaded) sound file of a pack.
+    """
+    print(f"{name}:")
+    total_lead = 0.0
+    total_tail = 0.0
+    n = 0
+    for sound_file in sound_files:
+        trim = sound_file.trim
+        if trim is None:
+            print(f"  {sound_file.name:24} not analyzed")
+            continue
+        # else
+        lead, tail = trim.lead_ms, trim.tail_ms
+        print(f"  {sound_file.name:24} lead: {lead:6.1f} ms   tail: {tail:6.1f} ms")
+        total_lead += trim.lead_ms
+        total_tail += trim.tail_ms
+        n += 1
+    #
+    print(f"  {'total':24} lead: {total_lead:6.1f} ms   tail: {total_tail:6.1f} ms")
+    if n > 0:
+        lead, tail = total_lead / n, total_tail / n
+        print(f"  {'average':24} lead: {lead:6.1f} ms   tail: {tail:6.1f} ms")
@@ -10,38 +10,25 @@ Play a sound file when you press a keyboard button.
 """
 
 import argparse
-import json
 import os
 import random
 import sys
-from enum import Enum, auto
-from glob import glob
 from pathlib import Path
-from time import sleep
-from typing import Any
+from time import perf_counter, sleep
+from typing import Any, Hashable, cast
 
-import simpleaudio as sa
-import sounddevice as sd
-import soundfile as sf
 from pynput import mouse
 from pynput.keyboard import Key, Listener
 
 from keysound import demo
+from keysound.idle import IdleMonitor
+from keysound.index import RESERVED_NAMES, SoundpackIndex, default_index_file
+from keysound.sound import C, Sound
+from keysound.stream import STREAM_THRESHOLD
+from keysound.trim import print_report
 
 VERSION = "0.1.11"
 
-
-# constants
-class C(Enum):
-    # Priority 1: play with sounddevice+soundfile
-    SD_SF = auto()
-    # Priority 2: play with simpleaudio
-    SA = auto()
-    # Priority 3: play in an external process (use this if you have problems with the previous two)
-    # this is a fallback solution
-    EXTERNAL = auto()
-
-
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))  # root directory of the application
 
 cfg: dict[Any, Any] = {
@@ -49,53 +36,63 @@ cfg: dict[Any, Any] = {
     "selected_soundpack": "default",  # may be modified later
     "mouse_clicks": 0,  # 0: no click, 1: click on press, 2: click on press and click on release
     "sounds_base_dir": str(Path(ROOT_DIR, "sounds")),
+    "sound_roots": [],  # extra soundpack folders (besides sounds_base_dir), see --root
+    "index_file": default_index_file(),  # persisted soundpack index
     "sound_on_key_up": False,  # Do you want sound when you release a button?
+    "trim_silence": True,  # cut the leading / trailing silence of the samples
+    "stream_threshold": STREAM_THRESHOLD,  # stream the files larger than this (bytes, 0: never)
+    "shared_bank": False,  # share the decoded samples with other keysound instances
+    "audio_process": False,  # decode and play the sounds in a child process
+    "idle_timeout": 0,  # close the output stream after this many seconds without input (0: never)
 }
 
 
+soundpack_index = SoundpackIndex([], cfg["index_file"])  # will be filled in process_soundpacks()
+
+
 def get_sounds_dir() -> str:
-    path = str(Path(cfg["sounds_base_dir"], cfg["selected_soundpack"]))
-    assert os.path.isdir(path)
-    return path
+    return soundpack_index.path(cfg["selected_soundpack"])
 
 
 def read_keysound_json() -> dict[str, str]:
-    try:
-        with open(Path(get_sounds_dir(), "keysound.json")) as f:
-            return json.load(f)  # type: ignore
-        #
-    except:
+    mapping = soundpack_index.packs[cfg["selected_soundpack"]]["keysound"]
+    if mapping is None:
         print("# keysound.json not found or couldn't be read")
         return {}
+    # else
+    return mapping  # type: ignore
 
 
-def process_soundpacks() -> None:
-    folders = [
-        Path(entry).name
-        for entry in glob(f'{cfg["sounds_base_dir"]}/*')
-        if os.path.isdir(entry) and not Path(entry).name.startswith("_")
-    ]
-    cfg["soundpacks"] = folders
+def process_soundpacks(rebuild: bool = False) -> None:
+    global soundpack_index
+    roots = [cfg["sounds_base_dir"]] + cfg["sound_roots"]
+    soundpack_index = SoundpackIndex(roots, cfg["index_file"])
+    if not rebuild:
+        soundpack_index.load()
+    soundpack_index.update(full=rebuild)
+    cfg["soundpacks"] = soundpack_index.names()
     assert cfg["selected_soundpack"] in cfg["soundpacks"], "Non-existing soundpack is selected"
-    assert (
-        "random" not in cfg["soundpacks"]
-    ), "Don't name your soundpack 'random', this name is reserved"
-
-
-process_soundpacks()
+    for name in RESERVED_NAMES:
+        assert (
+            name not in cfg["soundpacks"]
+        ), f"Don't name your soundpack '{name}', this name is reserved"
 
 
 def list_soundpacks() -> None:
     print("Available soundpacks:")
-    for sp in sorted(cfg["soundpacks"]):
-        print(f"* {sp}")
+    for sp in cfg["soundpacks"]:
+        entry = soundpack_index.packs[sp]
+        if entry["valid"]:
+            print(f"* {sp}")
+        else:
+            print(f"* {sp} (invalid: {', '.join(entry['errors'])})")
     #
     print("* random (select a soundpack randomly)")
 
 
 def select_soundpack(soundpack: str) -> None:
     if soundpack == "random":
-        cfg["selected_soundpack"] = random.choice(cfg["soundpacks"])
+        cfg["selected_soundpack"] = random.choice(soundpack_index.valid_names())
         return
     # else
     if soundpack not in cfg["soundpacks"]:
@@ -133,6 +130,19 @@ def init_argparse() -> argparse.Namespace:
         default=False,
         help="list available soundpacks and exit",
     )
+    parser.add_argument(
+        "-r",
+        "--root",
+        action="append",
+        default=[],
+        help="extra folder with soundpacks (can be used several times)",
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        default=False,
+        help="re-scan all the soundpacks (ignore the saved index)",
+    )
     parser.add_argument(
         "-p",
         "--play-all",
@@ -142,6 +152,36 @@ def init_argparse() -> argparse.Namespace:
     )
     parser.add_argument("-s", "--sound", help="which soundpack to use")
     parser.add_argument("-m", "--mouse", type=int, help="number of mouse clicks (0, 1 or 2)")
+    parser.add_argument(
+        "--audio-process",
+        action="store_true",
+        default=False,
+        help="play the sounds in a separate process (restarted if it crashes)",
+    )
+    parser.add_argument(
+        "-i",
+        "--idle",
+        type=float,
+        help="close the output stream after this many seconds without input (default: 0, never)",
+    )
+    parser.add_argument(
+        "--no-trim",
+        action="store_true",
+        default=False,
+        help="play the samples without cutting their leading / trailing silence",
+    )
+    parser.add_argument(
+        "--trim-report",
+        action="store_true",
+        default=False,
+        help="show how much silence is cut from the samples of each soundpack and exit",
+    )
+    parser.add_argument(
+        "--shared-bank",
+        action="store_true",
+        default=False,
+        help="share the decoded samples with other keysound instances (shared memory)",
+    )
     parser.add_argument(
         "-u",
         "--keyup",
@@ -154,124 +194,115 @@ def init_argparse() -> argparse.Namespace:
 
 
 args = init_argparse()
+cfg["sound_roots"].extend(os.path.abspath(root) for root in args.root)
+process_soundpacks(rebuild=args.rebuild_index)
 if args.sound:
     select_soundpack(args.sound)
 if args.mouse:
     select_mouse_clicks(args.mouse)
 if args.keyup:
     cfg["sound_on_key_up"] = True
+if args.no_trim:
+    cfg["trim_silence"] = False
+if args.shared_bank:
+    cfg["shared_bank"] = True
+if args.audio_process:
+    cfg["audio_process"] = True
+if args.idle is not None:
+    cfg["idle_timeout"] = args.idle
 if args.list:
     list_soundpacks()
     sys.exit(0)
 #
 
 
-class SoundFile:
-    def __init__(self, fname: str, playback=C.SD_SF) -> None:
-        """
-        Default playback method: sounddevice+soundfile
-        It plays most .wav files correctly. If there's a problem with
-        a particular .wav file, we can set a different playback method for it.
-        """
-        sounds_dir = get_sounds_dir()
-        self.name = Path(fname).name
-        self.fname_with_path = os.path.normpath(Path(sounds_dir, fname))
-        self.playback = playback
-        self.loaded = False
-        self.data = None  # will be set after loading the .wav file
-        # special cases
-
-        if self.name.startswith("mouse"):
-            self.playback = C.SA
-        if sounds_dir.endswith("banana") and self.name.startswith("enter"):
-            self.playback = C.EXTERNAL
-
-    def exists(self) -> bool:
-        return os.path.isfile(self.fname_with_path)
-
-    def _load(self):
-        if self.playback == C.SD_SF:
-            self.data = sf.read(self.fname_with_path)
-        elif self.playback == C.SA:
-            self.data = sa.WaveObject.from_wave_file(self.fname_with_path)
-        #
-        self.loaded = True
-
-    def _play_sound(self):
-        if self.playback == C.SD_SF:
-            sd.play(*(self.data))
-        elif self.playback == C.SA:
-            self.data.play()  # type: ignore
-        elif self.playback == C.EXTERNAL:
-            cmd = f"play -q '{self.fname_with_path}' &"
-            os.system(cmd)
-        else:
-            assert False, "Error: unknown playback method"
+def trim_report() -> None:
+    for name in soundpack_index.valid_names():
+        entry = soundpack_index.packs[name]
+        pack = Sound(entry["path"], entry["keysound"] or {}, soundpack_index.key_files(name))
+        pack.preload()
+        # by path: a key_up.wav is both pack.key_up and one of pack.keys
+        files = {key.fname_with_path: key for key in pack.collect_keys() if key.playback == C.SD_SF}
+        print_report(name, list(files.values()))
+    #
 
-    def play(self):
-        if not self.loaded:
-            self._load()
-        #
-        self._play_sound()
 
-    def __str__(self) -> str:
-        result = f"{self.name}"
-        return result
+if args.trim_report:
+    trim_report()
+    sys.exit(0)
+#
+
 
+def check_sound(sound: Sound) -> None:
+    for key in sound.missing():
+        print(f"Error: {key.fname_with_path} doesn't exist")
+        print("Tip: maybe you refer to it from a keysound.json file")
+        sys.exit(1)
+    #
 
-class Sound:
-    def __init__(self) -> None:
-        sounds_dir = get_sounds_dir()
-        ks_json = read_keysound_json()
-        #
-        self.enter = SoundFile("enter.wav")
-        self.space = SoundFile("space.wav")
-        self.keys = [SoundFile(Path(fname).name) for fname in glob(f"{sounds_dir}/key*.wav")]
-        self.key_up = SoundFile("key_up.wav")
-        #
-        self.mouse_down = SoundFile("mouse_down.wav")
-        self.mouse_up = SoundFile("mouse_up.wav")
-        #
-        self.prev_key: Key | None = None
-        #
-        if "mouse_down" in ks_json:
-            value = ks_json["mouse_down"]
-            self.mouse_down = SoundFile(value)
-        if "mouse_up" in ks_json:
-            value = ks_json["mouse_up"]
-            self.mouse_up = SoundFile(value)
-        if "key_up" in ks_json:
-            value = ks_json["key_up"]
-            self.key_up = SoundFile(value)
-        #
-        self.check()
-
-    def collect_keys(self) -> list[SoundFile]:
-        li = [self.enter, self.space, self.key_up, self.mouse_down, self.mouse_up]
-        li.extend(self.keys)
-        return li
-
-    def check(self):
-        for key in self.collect_keys():
-            if not key.exists():
-                print(f"Error: {key.fname_with_path} doesn't exist")
-                print("Tip: maybe you refer to it from a keysound.json file")
-                sys.exit(1)
-            #
-        #
 
-    def play_sound(self, key: Key) -> None:
-        if key == Key.enter:
-            sound.enter.play()
-        elif key == Key.space:
-            sound.space.play()
-        else:
-            index = abs(hash(key)) % len(self.keys)
-            audio = self.keys[index]
-            audio.play()
+def to_key_id(key: Key) -> Hashable:
+    if key == Key.enter:
+        return "enter"
+    if key == Key.space:
+        return "space"
+    # else
+    return cast(Hashable, key)
+
+
+sound = Sound(
+    get_sounds_dir(),
+    read_keysound_json(),
+    soundpack_index.key_files(cfg["selected_soundpack"]),
+    trim_silence=cfg["trim_silence"],
+    stream_threshold=cfg["stream_threshold"],
+)
+check_sound(sound)
+audio_process = None
+if cfg["audio_process"] and not args.play_all:
+    from keysound.audio_process import AudioProcess  # POSIX only
+
+    # the child process loads the samples (and maps the shared bank)
+    audio_process = AudioProcess(sound, cfg["shared_bank"], cfg["idle_timeout"])
+elif cfg["shared_bank"]:
+    sound.use_shared_bank()
+
+
+def close_audio() -> None:
+    """
+    Called when we become idle.
+    """
+    sound.suspend()
+    print("# idle: output stream closed")
+
+
+# with an audio process, the child process closes the output stream when idle
+idle_timeout = 0 if audio_process else cfg["idle_timeout"]
+idle_monitor = IdleMonitor(idle_timeout, on_idle=close_audio)
+
+
+def play(key_id: Hashable) -> None:
+    if audio_process:
+        audio_process.trigger(key_id)
+    else:
+        sound.play_sound(key_id)
+
+
+def wake_up() -> float | None:
+    """
+    Call it on every input event. If we were idle, it returns the
+    start time of the wake-up (to report the wake-up latency).
+    """
+    start = perf_counter()
+    if idle_monitor.touch():
+        return start
+    # else
+    return None
 
 
-sound = Sound()
+def report_wake_up(start: float | None) -> None:
+    if start is not None:
+        print(f"# active: wake-up latency {(perf_counter() - start) * 1000:.1f} ms")
 
 
 def on_press(key: Key) -> None:
@@ -279,16 +310,20 @@ def on_press(key: Key) -> None:
     if key == sound.prev_key:
         return
     #
+    start = wake_up()
     sound.prev_key = key
-    sound.play_sound(key)
+    play(to_key_id(key))
+    report_wake_up(start)
 
 
 def on_release(key: Key) -> None:
     # print("{0} release".format(key))
     # print("---")
+    start = wake_up()
     sound.prev_key = None
     if cfg["sound_on_key_up"]:
-        sound.key_up.play()
+        play("key_up")
+    report_wake_up(start)
 
 
 def on_click(x, y, button, pressed) -> None:
@@ -297,17 +332,19 @@ def on_click(x, y, button, pressed) -> None:
     if clicks == 0:
         return
     # else
+    start = wake_up()
     if clicks == 1:
         if pressed:
-            sound.mouse_down.play()
+            play("mouse_down")
         #
     elif clicks == 2:
         if pressed:
-            sound.mouse_down.play()
+            play("mouse_down")
         else:  # if released
-            sound.mouse_up.play()
+            play("mouse_up")
         #
     #
+    report_wake_up(start)
 
 
 def flush_input() -> None:
@@ -318,11 +355,16 @@ def main() -> None:
     folder = get_sounds_dir().removeprefix(ROOT_DIR).removeprefix("/")
     print(f"sound pack: {folder}")
     print(f"number of mouse clicks: {cfg['mouse_clicks']}")
+    if idle_monitor.enabled():
+        print(f"idle timeout: {cfg['idle_timeout']} sec")
     if args.play_all:
         demo.play_all_sounds(sound)
         return
     # else
     print("start typing...")
+    idle_monitor.start()
+    if audio_process:
+        audio_process.start()
     with Listener(on_press=on_press, on_release=on_release) as kbd_listener:
         with mouse.Listener(on_click=on_click) as mouse_listener:
             try:
@@ -333,6 +375,8 @@ def main() -> None:
                 sleep(0.15)
         #
     #
+    if audio_process:
+        audio_process.close()
     flush_input()
 
 
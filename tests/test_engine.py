@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip("simpleaudio")
+sd = pytest.importorskip("sounddevice")
+
+from keysound import Engine, stream  # noqa: E402
+
+# the sample formats accepted by sd.OutputStream (sd.play() converts float64, a stream doesn't)
+STREAM_DTYPES = ("float32", "int32", "int24", "int16", "int8", "uint8")
+
+
+class FakeOutputStream:
+    """
+    Checks the arguments like sounddevice does, but doesn't open a device.
+    """
+
+    opened: list[str] = []
+
+    def __init__(self, *, dtype, callback, finished_callback, **kwargs) -> None:
+        if dtype not in STREAM_DTYPES:
+            raise ValueError("Invalid output sample format")
+        # else
+        self.opened.append(dtype)
+        self.finished_callback = finished_callback
+
+    def start(self) -> None:
+        self.finished_callback()  # played at once
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    FakeOutputStream.opened = []
+    monkeypatch.setattr(stream.sd, "OutputStream", FakeOutputStream)
+    with Engine("default", index_file=str(tmp_path / "index.json"), stream_threshold=0) as engine:
+        yield engine
+    #
+
+
+@pytest.mark.parametrize("trim_silence", [True, False])
+def test_trigger_in_memory(monkeypatch, tmp_path, trim_silence):
+    monkeypatch.setattr(stream.sd, "OutputStream", FakeOutputStream)
+    FakeOutputStream.opened = []
+    index_file = str(tmp_path / "index.json")
+    with Engine("default", index_file=index_file, trim_silence=trim_silence) as engine:
+        engine.trigger("enter")
+        engine.trigger("a")
+    #
+    assert FakeOutputStream.opened == ["float32", "float32"]
+
+
+def test_batch_is_played_before_exit(engine):
+    engine.trigger_many([(0.0, "a"), (0.01, "b"), (0.02, "space")])
+    engine.wait()
+    assert len(FakeOutputStream.opened) == 3
+
+
+def test_scheduler_survives_errors(engine, monkeypatch):
+    played = []
+
+    def play_sound(key_id):
+        if key_id == "bad":
+            raise RuntimeError("boom")
+        # else
+        played.append(key_id)
+
+    monkeypatch.setattr(engine.sound, "play_sound", play_sound)
+    engine.trigger_many([(0.0, "bad"), (0.01, "a")])
+    engine.wait()
+    engine.trigger_many([(0.0, "b")])
+    engine.wait()
+    assert played == ["a", "b"]